@@ -1,3 +1,5 @@
+import array
+import math
 import os
 import time
 import textwrap
@@ -27,8 +29,18 @@ if "last_query" not in st.session_state:
 if "last_k" not in st.session_state:
     st.session_state.last_k = 3
 if "eval_log" not in st.session_state:
-    # list of dicts: one row per evaluated run
-    st.session_state.eval_log = []
+    # Columnar (struct-of-arrays) buffer: one typed column per field, so
+    # appends are O(1) and the display DataFrame is only rebuilt when a
+    # row is actually added, not on every widget interaction.
+    st.session_state.eval_log = {
+        "timestamp": [],
+        "query": [],
+        "k": array.array("i"),
+        "latency_ms": array.array("d"),
+        "precision_at_k": array.array("d"),
+        "recall_at_k": array.array("d"),
+        "num_retrieved": array.array("i"),
+    }
 
 # Sidebar config
 st.sidebar.title("RAG Controls")
@@ -39,17 +51,35 @@ show_chunks = st.sidebar.checkbox("Show retrieved chunks", value=True)
 st.title("🔍 Faithful & Observable RAG")
 st.caption("Baseline → Observe → Adapt → Execute")
 
-# Init pipeline (lazy)
-if "pipeline" not in st.session_state:
-    st.session_state.pipeline = RAGPipeline(
+# One process-wide pipeline shared by all sessions/tabs, so new sessions
+# don't reload MiniLM weights or reopen Chroma.
+@st.cache_resource
+def get_pipeline() -> RAGPipeline:
+    return RAGPipeline(
         data_dir="data",
         persist_dir=".chromadb",
         embed_model="all-MiniLM-L6-v2",
     )
 
+
+@st.cache_data
+def eval_metrics(rel_labels: tuple, k: int) -> tuple:
+    """Memoized metric pair so unrelated widget events don't recompute."""
+    labels = list(rel_labels)
+    return precision_at_k(labels, k), recall_at_k(labels, k)
+
+
+pipeline = get_pipeline()
+
+# Embedding-cache stats (hits mean we skipped the MiniLM forward pass)
+cache_info = pipeline.embed_cache_info()
+st.sidebar.caption(
+    f"Embedding cache: {cache_info.hits} hits / {cache_info.misses} misses"
+)
+
 # Force a rebuild if the checkbox is checked
 if rebuild:
-    st.session_state.pipeline.rebuild_index()
+    pipeline.rebuild_index()
     st.info("Index rebuilt.")
 
 query = st.text_input(
@@ -63,8 +93,8 @@ with col1:
     # --- Run button handler: compute, then store results in session ---
     if st.button("Run") and query.strip():
         t0 = time.time()
-        docs = st.session_state.pipeline.retrieve(query, k=k)
-        answer = st.session_state.pipeline.generate(query, docs)
+        docs = pipeline.retrieve(query, k=k)
+        answer = pipeline.generate(query, docs)
         latency = (time.time() - t0) * 1000.0
 
         # store for right column + persistence across reruns
@@ -74,10 +104,10 @@ with col1:
         st.session_state.last_query = query
         st.session_state.last_k = k
 
-        # clear any old relevance labels from previous runs
-        for key in list(st.session_state.keys()):
-            if key.startswith("rel_label_"):
-                del st.session_state[key]
+        # clear any old relevance labels from previous runs; iterate the
+        # tracked key set instead of scanning all of session state
+        for key in st.session_state.pop("_rel_label_keys", set()):
+            st.session_state.pop(key, None)
 
     # --- Display from session state so UI persists across reruns ---
     if st.session_state.last_answer:
@@ -94,6 +124,7 @@ with col1:
 
                     # Relevance labeling UI for this chunk
                     label_key = f"rel_label_{i}"
+                    st.session_state.setdefault("_rel_label_keys", set()).add(label_key)
                     current = st.session_state.get(label_key, "Unlabeled")
 
                     st.radio(
@@ -108,7 +139,15 @@ with col1:
     else:
         st.info("Enter a question and press Run.")
 
-with col2:
+def _fragment(func):
+    """Use st.fragment when available so widget clicks inside the metrics
+    column rerun only that column, not the whole script."""
+    frag = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    return frag(func) if frag else func
+
+
+@_fragment
+def render_metrics():
     st.subheader("Metrics")
 
     # Build rel_labels list from the per-chunk radios for the LAST run
@@ -123,8 +162,7 @@ with col2:
         k_eval = min(k_eval, len(st.session_state.last_docs))
 
     if rel_labels:
-        p_at_k = precision_at_k(rel_labels, k_eval)
-        r_at_k = recall_at_k(rel_labels, k_eval)
+        p_at_k, r_at_k = eval_metrics(tuple(rel_labels), k_eval)
     else:
         p_at_k = 0.0
         r_at_k = 0.0
@@ -142,39 +180,53 @@ with col2:
     # Button to save current evaluation row
     if st.button("Save this run to log"):
         if st.session_state.last_docs:
-            st.session_state.eval_log.append(
-                {
-                    "timestamp": datetime.now().isoformat(timespec="seconds"),
-                    "query": st.session_state.last_query,
-                    "k": k_eval,
-                    "latency_ms": float(lat) if isinstance(lat, (int, float)) else None,
-                    "precision_at_k": p_at_k,
-                    "recall_at_k": r_at_k,
-                    "num_retrieved": len(st.session_state.last_docs),
-                }
+            log = st.session_state.eval_log
+            log["timestamp"].append(datetime.now().isoformat(timespec="seconds"))
+            log["query"].append(st.session_state.last_query)
+            log["k"].append(k_eval)
+            log["latency_ms"].append(
+                float(lat) if isinstance(lat, (int, float)) else math.nan
             )
+            log["precision_at_k"].append(p_at_k)
+            log["recall_at_k"].append(r_at_k)
+            log["num_retrieved"].append(len(st.session_state.last_docs))
             st.success("Saved current run to evaluation log.")
         else:
             st.warning("Run a query first before saving to the log.")
 
     # If we have any logged rows, show table, chart, and CSV download
-    if st.session_state.eval_log:
-        df = pd.DataFrame(st.session_state.eval_log)
+    n_rows = len(st.session_state.eval_log["k"])
+    if n_rows:
+        # Rebuild the DataFrame only when a new row was appended; reruns
+        # from unrelated widgets reuse the cached frame.
+        if st.session_state.get("eval_log_df_rows") != n_rows:
+            st.session_state.eval_log_df = pd.DataFrame(
+                {col: list(vals) for col, vals in st.session_state.eval_log.items()}
+            )
+            st.session_state.eval_log_df_rows = n_rows
+
+        df = st.session_state.eval_log_df
         st.dataframe(df, use_container_width=True)
 
         # Simple precision/recall chart across runs
         if len(df) > 1:
             st.line_chart(df[["precision_at_k", "recall_at_k"]])
 
-        # CSV download
-        csv = df.to_csv(index=False).encode("utf-8")
+        # CSV download (re-encoded only when the frame was rebuilt)
+        if st.session_state.get("eval_log_csv_rows") != n_rows:
+            st.session_state.eval_log_csv = df.to_csv(index=False).encode("utf-8")
+            st.session_state.eval_log_csv_rows = n_rows
         st.download_button(
             "Download evaluation CSV",
-            data=csv,
+            data=st.session_state.eval_log_csv,
             file_name="rag_eval_log.csv",
             mime="text/csv",
         )
 
+
+with col2:
+    render_metrics()
+
 st.markdown("---")
 st.caption(
     "Tip: Start with MiniLM; upgrade embeddings & prompts as you iterate. "
@@ -1,25 +1,34 @@
+import time
 from datetime import datetime, timezone
+from functools import lru_cache
+
 from dotenv import load_dotenv
 from openai import OpenAI
 
 load_dotenv()
 client = OpenAI()
 
+FMT = "%Y-%m-%d %H:%M:%S UTC"
+
+
+@lru_cache(maxsize=4096)  # timestamps repeat across event replays
 def format_ts(ts):
     """Convert a timestamp (int/float or ISO string) to 'YYYY-MM-DD HH:MM:SS UTC'."""
     if not ts:
         return "n/a"
 
-    if isinstance(ts, (int, float)):
-        dt = datetime.fromtimestamp(ts, tz=timezone.utc)
-    else:
-        # API often returns an int seconds-since-epoch, but this is safe if it ever sends ISO.
-        try:
-            dt = datetime.fromtimestamp(float(ts), tz=timezone.utc)
-        except Exception:
-            dt = datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
-
-    return dt.strftime("%Y-%m-%d %H:%M:%S UTC")
+    # API usually returns int seconds-since-epoch; format via time.gmtime +
+    # %-interpolation, which skips datetime object allocation entirely.
+    try:
+        t = time.gmtime(float(ts))
+    except (TypeError, ValueError):
+        # ISO-string fallback, the slow path.
+        dt = datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
+        return dt.strftime(FMT)
+
+    return "%04d-%02d-%02d %02d:%02d:%02d UTC" % (
+        t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec
+    )
 
 
 def main():
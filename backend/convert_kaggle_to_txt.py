@@ -1,8 +1,13 @@
+import io
 import os
+import tarfile
+import time
+
 import pandas as pd
 
 CSV_PATH = "data_science_concepts.csv"  # adjust if needed
 OUTPUT_DIR = "data"  # this should be the same as RAGPipeline.data_dir
+TAR_NAME = "corpus.tar"  # RAGPipeline indexes this archive directly
 
 def main():
     os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -13,23 +18,29 @@ def main():
     if "Question" not in df.columns or "Answer" not in df.columns:
         raise ValueError("CSV must have 'Question' and 'Answer' columns")
 
-    for idx, row in df.iterrows():
-        q = str(row["Question"]).strip()
-        a = str(row["Answer"]).strip()
-
-        if not q and not a:
-            continue
-
-        filename = f"data_science_{idx:04d}.txt"
-        out_path = os.path.join(OUTPUT_DIR, filename)
-
-        with open(out_path, "w", encoding="utf-8") as f:
-            f.write(f"Question: {q}\n\n")
-            f.write("Answer:\n")
-            f.write(a)
-            f.write("\n")
-
-    print(f"Done! Wrote {len(df)} text files into '{OUTPUT_DIR}'.")
+    # Build all file contents at once with vectorized string ops —
+    # no per-row pandas boxing from iterrows().
+    q = df["Question"].astype(str).str.strip()
+    a = df["Answer"].astype(str).str.strip()
+    contents = "Question: " + q + "\n\nAnswer:\n" + a + "\n"
+    mask = (q != "") | (a != "")
+
+    # One tar archive instead of thousands of tiny files: a single open()
+    # and sequential writes, and index builds read it back sequentially too.
+    tar_path = os.path.join(OUTPUT_DIR, TAR_NAME)
+    mtime = int(time.time())
+    n_written = 0
+
+    with tarfile.open(tar_path, "w") as tar:
+        for idx, text in contents[mask].items():
+            data = text.encode("utf-8")
+            info = tarfile.TarInfo(name=f"data_science_{idx:04d}.txt")
+            info.size = len(data)
+            info.mtime = mtime
+            tar.addfile(info, io.BytesIO(data))
+            n_written += 1
+
+    print(f"Done! Wrote {n_written} documents into '{tar_path}'.")
 
 if __name__ == "__main__":
     main()
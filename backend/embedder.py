@@ -0,0 +1,177 @@
+import os
+import shutil
+from functools import lru_cache
+from typing import List, Optional
+
+import numpy as np
+import torch
+
+from sentence_transformers import SentenceTransformer
+
+# HF tokenizers spawn their own thread pool per process; with our batched
+# encode() calls the fork-safety warnings and pool contention aren't worth it.
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+# --- Optional ONNX Runtime fast path ---
+try:
+    import onnxruntime  # noqa: F401  (presence check)
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+    _HAS_ONNX = True
+except Exception:
+    _HAS_ONNX = False  # fall back to plain SentenceTransformer
+
+
+class ONNXQuantizedEmbedder:
+    """
+    MiniLM embedder exported to ONNX with dynamic int8 quantization.
+
+    Exposes the same `.encode(texts) -> np.ndarray` surface as
+    SentenceTransformer so RAGPipeline can swap it in without changes.
+    On CPU the int8 GEMMs are roughly 3x faster than the FP32 PyTorch
+    forward pass, with a ~4x smaller model on disk.
+    """
+
+    def __init__(self, model_name: str, cache_dir: Optional[str] = None):
+        # Conversion output lives on disk so the export + quantization cost
+        # is paid once per model; ONNX_CACHE_DIR relocates it (e.g. next to
+        # the Chroma persist dir on a fast volume).
+        if cache_dir is None:
+            cache_dir = os.getenv("ONNX_CACHE_DIR", ".onnx_models")
+
+        # SentenceTransformer short names map to the sentence-transformers org on the Hub.
+        if "/" not in model_name:
+            model_name = f"sentence-transformers/{model_name}"
+
+        quantized_dir = os.path.join(
+            cache_dir, model_name.replace("/", "__") + "-int8"
+        )
+
+        if not os.path.isdir(quantized_dir):
+            # One-time export + dynamic int8 quantization, cached on disk.
+            # Built in a scratch dir promoted by rename at the end, so a
+            # crashed or interrupted export can never pass the isdir check
+            # above as a complete model on the next run.
+            tmp_dir = quantized_dir + ".tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            model = ORTModelForFeatureExtraction.from_pretrained(
+                model_name, export=True
+            )
+            quantizer = ORTQuantizer.from_pretrained(model)
+            qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False)
+            quantizer.quantize(save_dir=tmp_dir, quantization_config=qconfig)
+            # quantize() saves only the model + quantization config; the
+            # tokenizer must be stored alongside or from_pretrained on the
+            # cached dir fails and the fast path silently never activates.
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(tmp_dir)
+            os.replace(tmp_dir, quantized_dir)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(quantized_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            quantized_dir,
+            provider="CPUExecutionProvider",
+            session_options=self._session_options(),
+        )
+
+    @staticmethod
+    def _session_options():
+        import onnxruntime as ort
+
+        # One op at a time, parallelized internally: inter_op stays at 1 so
+        # concurrent encode() calls from the API's worker threads don't
+        # multiply thread pools and oversubscribe the cores. EMBED_THREADS
+        # pins intra-op parallelism (e.g. 1 when serving many concurrent
+        # queries, default all cores for bulk index builds).
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = int(
+            os.getenv("EMBED_THREADS", os.cpu_count() or 1)
+        )
+        opts.inter_op_num_threads = 1
+        return opts
+
+    def encode(self, texts) -> np.ndarray:
+        """
+        Embed a string or list of strings. Mean-pools token embeddings with
+        the attention mask, then L2-normalizes (matching SentenceTransformer
+        output for MiniLM).
+        """
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+
+        enc = self.tokenizer(
+            texts, padding=True, truncation=True, return_tensors="np"
+        )
+        out = self.model(**enc)
+        hidden = np.asarray(out.last_hidden_state)
+
+        mask = enc["attention_mask"][..., None].astype(hidden.dtype)
+        summed = (hidden * mask).sum(axis=1)
+        counts = np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled = summed / counts
+
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        pooled = pooled / np.clip(norms, 1e-12, None)
+
+        return pooled[0] if single else pooled
+
+
+class _UnitNormSentenceTransformer:
+    """
+    Thin wrapper that makes SentenceTransformer.encode() L2-normalize by
+    default, matching the ONNX path above. With every stored and query
+    vector at unit length, cosine similarity reduces to a plain dot
+    product, which is what lets the index run in "ip" space.
+    """
+
+    def __init__(self, model: SentenceTransformer):
+        self.model = model
+
+    def encode(self, texts, **kwargs):
+        kwargs.setdefault("normalize_embeddings", True)
+        return self.model.encode(texts, **kwargs)
+
+
+def _torch_device() -> str:
+    """Best available torch device for the eager SentenceTransformer path."""
+    if torch.cuda.is_available():
+        return "cuda"
+    mps = getattr(torch.backends, "mps", None)
+    if mps is not None and mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+@lru_cache(maxsize=4)
+def load_embedder(model_name: str):
+    """
+    Return the fastest available embedder for `model_name`:
+    int8 ONNX Runtime when optimum/onnxruntime are installed, otherwise
+    the plain SentenceTransformer.
+
+    Memoized per model name so every RAGPipeline (FastAPI worker reloads,
+    the Streamlit app, scripts) shares one loaded model instead of paying
+    the weight load and its ~90 MB again per instance.
+    """
+    if _HAS_ONNX:
+        try:
+            return ONNXQuantizedEmbedder(model_name)
+        except Exception:
+            pass  # export/quantization failed; use the safe path
+
+    # Eager fallback pinned to the best device at construction, so Chroma
+    # or callers can never silently run the encoder on CPU when an
+    # accelerator exists.
+    device = _torch_device()
+    model = SentenceTransformer(model_name, device=device)
+    # Encoder inference is memory-bound, so on GPU fp16 halves activation
+    # bytes for ~2x throughput at negligible cosine drift; CPU keeps fp32
+    # (the int8 ONNX path above is the CPU fast lane). Set EMBED_FP16=0 to
+    # force full precision, e.g. when validating ranking parity.
+    if device == "cuda" and os.getenv("EMBED_FP16", "1") != "0":
+        try:
+            model = model.half()
+        except Exception:
+            pass
+    return _UnitNormSentenceTransformer(model)
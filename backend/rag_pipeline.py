@@ -1,12 +1,22 @@
 ﻿import os
-import glob
+import gc
+import hashlib
+import json
+import mmap
+import tarfile
+import asyncio
+import weakref
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
 
+import numpy as np
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
 import chromadb
-from chromadb.utils import embedding_functions
+
+from embedder import load_embedder
 
 # --- LLM (OpenAI) ---
 try:
@@ -14,6 +24,106 @@ try:
 except Exception:
     OpenAI = None  # fallback if lib not installed yet
 
+try:
+    from openai import AsyncOpenAI
+except Exception:
+    AsyncOpenAI = None  # older SDKs: generation falls back to the sync chain
+
+try:
+    import tiktoken
+except Exception:
+    tiktoken = None  # truncation falls back to a chars-per-token heuristic
+
+
+def configure_hnsw_params(count: int) -> Dict:
+    """
+    Size Chroma's HNSW build/search parameters to the corpus. A wider
+    graph (M) and higher construction_ef cost a little at index time but
+    keep recall high as the collection grows; search_ef bounds per-query
+    traversal. Tiers: <100k, 100k-1M, >1M vectors.
+    """
+    if count < 100_000:
+        m, efc, efs = 16, 128, 64
+    elif count < 1_000_000:
+        m, efc, efs = 24, 128, 100
+    else:
+        m, efc, efs = 32, 200, 200
+    return {
+        # Both embedder paths emit unit-length vectors, so cosine reduces
+        # to a plain dot product: "ip" space skips the per-candidate norm
+        # in every HNSW distance eval while ranking identically. The
+        # reported distance (1 - dot) also matches cosine distance, so the
+        # relevance thresholds downstream are unaffected.
+        "hnsw:space": "ip",
+        "hnsw:M": m,
+        "hnsw:construction_ef": efc,
+        "hnsw:search_ef": efs,
+        "hnsw:num_threads": os.cpu_count() or 4,
+    }
+
+
+# Default for a fresh collection, before any corpus size is known.
+HNSW_METADATA = configure_hnsw_params(0)
+
+# .env is parsed once per process; every later RAGPipeline construction
+# skips the dotfile search + file parse.
+_DOTENV_LOADED = False
+
+
+def _load_dotenv_once() -> None:
+    global _DOTENV_LOADED
+    if not _DOTENV_LOADED:
+        load_dotenv()
+        _DOTENV_LOADED = True
+
+
+# One Chroma client per persist_dir: PersistentClient opens sqlite and the
+# HNSW segment files, so sharing it across RAGPipeline instances avoids
+# redundant handles (and Chroma objects to the same path being opened twice
+# with different settings).
+_CHROMA_CLIENTS: Dict[str, chromadb.PersistentClient] = {}
+
+
+def _get_chroma_client(persist_dir: str) -> chromadb.PersistentClient:
+    client = _CHROMA_CLIENTS.get(persist_dir)
+    if client is None:
+        client = chromadb.PersistentClient(path=persist_dir)
+        _CHROMA_CLIENTS[persist_dir] = client
+    return client
+
+
+@lru_cache(maxsize=4)
+def _token_encoding(model_name: str):
+    """
+    Memoized tiktoken encoding for `model_name` (encoding_for_model does a
+    registry lookup and BPE load on first call). None when tiktoken is
+    missing, which switches truncation to the character heuristic.
+    """
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except Exception:
+        try:
+            return tiktoken.get_encoding("o200k_base")
+        except Exception:
+            return None
+
+
+def _load_and_warm_embedder(model_name: str):
+    """
+    Load the embedder and run one throwaway encode so first-use costs
+    (tokenizer allocation, CUDA context / cuDNN autotune, ONNX session
+    warmup) are paid here — on the background thread — rather than by the
+    first user query.
+    """
+    embedder = load_embedder(model_name)
+    try:
+        embedder.encode(["warmup"])
+    except Exception:
+        pass  # warmup is best-effort; a real encode will surface errors
+    return embedder
+
 
 @dataclass
 class Document:
@@ -24,6 +134,42 @@ class Document:
     metadata: Dict
 
 
+# Column-oriented retrieval result: parallel columns instead of one
+# metadata dict per hit. Numeric columns are NumPy arrays.
+Retrieval = namedtuple("Retrieval", "sources chunks distances texts ids")
+
+
+class _FallbackAnswer(str):
+    """
+    String subclass marking an answer produced by the no-LLM baseline
+    path, so callers can tell a degraded answer from a real one without
+    parsing the text.
+    """
+
+
+def is_fallback_answer(answer: str) -> bool:
+    """True when `answer` came from the baseline fallback, not an LLM."""
+    return isinstance(answer, _FallbackAnswer)
+
+class _PipelineEmbeddingFunction:
+    """
+    Chroma embedding-function adapter over the pipeline's own embedder, so
+    the collection shares the one model we already loaded (the int8 ONNX
+    fast path when available) instead of pulling up a second
+    SentenceTransformer inside SentenceTransformerEmbeddingFunction.
+    """
+
+    def __init__(self, embedder):
+        self._embedder = embedder
+
+    def __call__(self, input):
+        vecs = self._embedder.encode(list(input))
+        return [[float(x) for x in v] for v in vecs]
+
+    def name(self) -> str:
+        return "pipeline-embedder"
+
+
 class RAGPipeline:
     """
     End-to-end RAG pipeline:
@@ -45,7 +191,7 @@ class RAGPipeline:
         llm_finetuned_model: Optional[str] = None,
         use_finetuned_by_default: bool = True,
     ):
-        load_dotenv()  # read .env once here
+        _load_dotenv_once()  # read .env once per process
 
         self.data_dir = data_dir
         self.persist_dir = persist_dir
@@ -55,17 +201,45 @@ class RAGPipeline:
         self.embed_model = embed_model
 
         # ---------- Embeddings ----------
-        # Kept in case you want to use it directly later (e.g., custom eval)
-        self.embedder = SentenceTransformer(self.embed_model)
+        # int8 ONNX fast path when available, SentenceTransformer otherwise;
+        # both expose the same encode() API. The load (plus a warmup encode)
+        # runs on a background thread so it overlaps the Chroma client and
+        # cache setup below instead of serializing in front of them; the
+        # future is resolved right before the collection needs the model.
+        warm_pool = ThreadPoolExecutor(max_workers=1)
+        embedder_future = warm_pool.submit(_load_and_warm_embedder, embed_model)
+
+        # Per-instance LRU over query embeddings so repeated queries skip the
+        # MiniLM forward pass entirely (cache hit = dict lookup, not ~10-50ms
+        # of CPU inference). Wrapping here keeps `self` out of the cache key.
+        self._embed_query = lru_cache(maxsize=1024)(self._embed_query_uncached)
+        # Same per-instance pattern for the chunker: identical file
+        # contents are re-chunked for free on rebuilds.
+        self._chunk = lru_cache(maxsize=128)(self._chunk_uncached)
+
+        # LLM answers, keyed by (model, query, retrieved chunks); loaded
+        # lazily from disk on first use.
+        self._llm_cache: Optional[Dict[str, str]] = None
+
+        # Retrieval results are pure in (query, k, index version); caching
+        # them skips the ANN lookup too, and the version stamp in the key
+        # invalidates everything on rebuild without an explicit clear.
+        self._index_version = 0
+        self._retrieve = lru_cache(maxsize=1024)(self._retrieve_uncached)
 
         # ---------- Vector store (Chroma) ----------
-        self.client = chromadb.PersistentClient(path=self.persist_dir)
+        self.client = _get_chroma_client(self.persist_dir)
+
+        # Join the background load: by now the Chroma client is up and the
+        # caches are wired, so little or none of the model load is left.
+        self.embedder = embedder_future.result()
+        warm_pool.shutdown(wait=False)
+
+        self._embedding_function = _PipelineEmbeddingFunction(self.embedder)
         self.collection = self.client.get_or_create_collection(
             name="docs",
-            metadata={"hnsw:space": "cosine"},
-            embedding_function=embedding_functions.SentenceTransformerEmbeddingFunction(
-                model_name=self.embed_model
-            ),
+            metadata=dict(HNSW_METADATA),
+            embedding_function=self._embedding_function,
         )
 
         # Build index if empty
@@ -112,34 +286,174 @@ class RAGPipeline:
                 # If something goes wrong, we just fall back to baseline answers.
                 self._openai_client = None
 
+        # Async clients for the hedged generate() path are created per
+        # event loop (see _async_openai_client): httpx binds its keep-alive
+        # pool to the loop that opened the sockets, so one client shared
+        # between the server loop and throwaway asyncio.run() loops dies
+        # with "Event loop is closed" on the second loop that touches it.
+        self._openai_async_enabled = bool(AsyncOpenAI and self._openai_key)
+        self._openai_async_clients: "weakref.WeakKeyDictionary" = (
+            weakref.WeakKeyDictionary()
+        )
+
     # ---------------------- Indexing ----------------------
 
+    # Extensions indexed from data_dir; tuple form feeds str.endswith.
+    _SOURCE_EXTS = (".txt", ".md")
+
     def _iter_source_files(self):
         """
-        Yield all supported text-like files under data_dir.
+        Yield all supported text-like files under data_dir with a single
+        scandir pass — one directory read, no per-pattern glob scan, and
+        is_file() comes from the dirent instead of an extra stat.
         """
-        exts = ("*.txt", "*.md")
-        for ext in exts:
-            for path in glob.glob(os.path.join(self.data_dir, ext)):
-                yield path
+        try:
+            entries = os.scandir(self.data_dir)
+        except FileNotFoundError:
+            return
+        with entries as it:
+            for entry in it:
+                if entry.name.endswith(self._SOURCE_EXTS) and entry.is_file():
+                    yield entry.path
+
+    # Files above this take the mmap read path.
+    _MMAP_THRESHOLD = 1 << 20
 
     def _read_file(self, path: str) -> str:
+        """
+        Read one source file. Large files are decoded straight out of an
+        mmap view — the kernel pages the bytes in and decode() consumes
+        them without an intermediate read() buffer, so peak RSS during an
+        index build is one copy instead of two. Small files just read().
+        """
+        if os.path.getsize(path) >= self._MMAP_THRESHOLD:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    mv = memoryview(mm)
+                    try:
+                        return str(mv, "utf-8", "ignore")
+                    finally:
+                        mv.release()
+                finally:
+                    mm.close()
+
         with open(path, "r", encoding="utf-8", errors="ignore") as f:
             return f.read()
 
-    def _chunk(self, text: str, chunk_size: int = 700, overlap: int = 100) -> List[str]:
+    def _iter_source_texts(self):
+        """
+        Yield (name, text) for every corpus document.
+
+        Prefers a single data/corpus.tar archive (one open() and a
+        sequential read for the whole corpus, instead of thousands of
+        per-file syscalls), then falls through to any loose .txt/.md files.
+        """
+        tar_path = os.path.join(self.data_dir, "corpus.tar")
+        if os.path.exists(tar_path):
+            with tarfile.open(tar_path, "r") as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    fobj = tar.extractfile(member)
+                    if fobj is None:
+                        continue
+                    name = os.path.basename(member.name)
+                    yield name, fobj.read().decode("utf-8", errors="ignore")
+
+        for path in self._iter_source_files():
+            yield os.path.basename(path), self._read_file(path)
+
+    def _chunk_uncached(
+        self, text: str, chunk_size: int = 700, overlap: int = 100
+    ) -> Tuple[str, ...]:
         """
-        Very simple word-based chunker.
+        Word-based chunker, fully vectorized: word start/end offsets come
+        from NumPy boolean masks over the UTF-8 bytes, chunk boundaries are
+        one strided gather, and each chunk is a single slice+decode — no
+        per-word Python objects at any point.
         chunk_size and overlap are in *words*, not tokens.
+        Returns a tuple so results are safe to share from the lru_cache.
+        """
+        data = text.encode("utf-8")
+        arr = np.frombuffer(data, dtype=np.uint8)
+        if arr.size == 0:
+            return ()
+
+        # ASCII whitespace (space + \t..\r); UTF-8 continuation bytes are
+        # >= 0x80 so multi-byte characters can never be misread as spaces.
+        is_ws = (arr == 32) | ((arr >= 9) & (arr <= 13))
+        non_ws = ~is_ws
+
+        prev_ws = np.empty_like(is_ws)
+        prev_ws[0] = True
+        prev_ws[1:] = is_ws[:-1]
+        starts = np.flatnonzero(non_ws & prev_ws)
+        if starts.size == 0:
+            return ()
+
+        next_ws = np.empty_like(is_ws)
+        next_ws[-1] = True
+        next_ws[:-1] = is_ws[1:]
+        ends = np.flatnonzero(non_ws & next_ws) + 1
+
+        n = starts.size
+        step = max(1, chunk_size - overlap)
+        first = np.arange(0, n, step)
+        last = np.minimum(first + chunk_size, n) - 1
+
+        return tuple(
+            data[s:e].decode("utf-8", "ignore")
+            for s, e in zip(starts[first].tolist(), ends[last].tolist())
+        )
+
+    async def _embed_all_async(
+        self,
+        texts: List[str],
+        batch_size: int = 128,
+        max_concurrency: int = 4,
+    ) -> List[List[float]]:
+        """
+        Embed many texts in bounded-concurrency batches.
+
+        Batches are grouped by length (shortest first) so each encode() call
+        pads to a similar sequence length, then dispatched through a small
+        thread pool with asyncio.gather. Outputs are reassembled in the
+        original order before returning.
+        """
+        # Sort by approximate token count (whitespace gaps), not raw chars:
+        # padding waste is per token, and word count tracks the tokenizer's
+        # output length more closely than character length does.
+        order = sorted(range(len(texts)), key=lambda i: texts[i].count(" "))
+        batches = [
+            order[i: i + batch_size] for i in range(0, len(order), batch_size)
+        ]
+
+        loop = asyncio.get_running_loop()
+        sem = asyncio.Semaphore(max_concurrency)
+        results: List[Optional[List[float]]] = [None] * len(texts)
+
+        async def encode_batch(pool: ThreadPoolExecutor, idxs: List[int]) -> None:
+            batch_texts = [texts[i] for i in idxs]
+            async with sem:
+                vecs = await loop.run_in_executor(
+                    pool, self.embedder.encode, batch_texts
+                )
+            for i, vec in zip(idxs, vecs):
+                results[i] = [float(x) for x in vec]
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            await asyncio.gather(*(encode_batch(pool, b) for b in batches))
+
+        return results  # type: ignore[return-value]
+
+    def embed_all(self, texts: List[str], batch_size: int = 128) -> List[List[float]]:
         """
-        words = text.split()
-        chunks: List[str] = []
-        i = 0
-        while i < len(words):
-            chunk_words = words[i: i + chunk_size]
-            chunks.append(" ".join(chunk_words))
-            i += max(1, chunk_size - overlap)
-        return chunks
+        Synchronous entry point for bulk embedding (used by index builds).
+        """
+        if not texts:
+            return []
+        return asyncio.run(self._embed_all_async(texts, batch_size=batch_size))
 
     def _build_index(self) -> None:
         """
@@ -154,11 +468,24 @@ class RAGPipeline:
 
         global_chunk_idx: int = 0  # 🔹 global counter for chunk numbers
 
-        for path in self._iter_source_files():
-            text = self._read_file(path)
-            base = os.path.basename(path)
+        # Read + chunk files on a thread pool (I/O bound, so threads are
+        # fine); the append below stays serial so global chunk numbering
+        # is deterministic.
+        def _read_and_chunk(item):
+            base, text = item
+            return base, hashlib.sha1(text.encode("utf-8")).hexdigest(), self._chunk(text)
+
+        with ThreadPoolExecutor(
+            max_workers=min(32, (os.cpu_count() or 4) * 4)
+        ) as ex:
+            per_file = list(ex.map(_read_and_chunk, self._iter_source_texts()))
+
+        fingerprints: Dict[str, str] = {
+            base: digest for base, digest, _ in per_file
+        }
 
-            for chunk_text in self._chunk(text):
+        for base, _, file_chunks in per_file:
+            for chunk_text in file_chunks:
                 docs.append(chunk_text)
                 # Use global chunk index in both id and metadata
                 ids.append(f"{base}::{global_chunk_idx}")
@@ -169,64 +496,388 @@ class RAGPipeline:
                 global_chunk_idx += 1
 
         if docs:
-            self.collection.add(documents=docs, metadatas=metas, ids=ids)
+            # Identical chunk texts (boilerplate repeated across files) are
+            # embedded once and the vector reused for every duplicate, so
+            # build time scales with unique content rather than raw size.
+            unique_pos: Dict[str, int] = {}
+            unique_texts: List[str] = []
+            dup_of: List[int] = []
+            for d in docs:
+                pos = unique_pos.get(d)
+                if pos is None:
+                    pos = len(unique_texts)
+                    unique_pos[d] = pos
+                    unique_texts.append(d)
+                dup_of.append(pos)
+
+            # On-disk cache: chunks whose content hash already has a vector
+            # from a previous build skip the encoder, so a rebuild after a
+            # one-file edit only embeds that file's chunks.
+            cache_index, cache_vecs = self._load_embed_cache()
+            keys = [self._embed_cache_key(t) for t in unique_texts]
+            miss_idx = [
+                i for i, key in enumerate(keys) if key not in cache_index
+            ]
+
+            # Embed ourselves (batched + concurrent) instead of letting
+            # Chroma's embedding function encode serially, then shard the
+            # insert into fixed slices — Chroma caps add() batch sizes, so
+            # large corpora would otherwise fail on one giant call. Each
+            # shard's embedding list is materialized from the unique pool
+            # just-in-time, so duplicates never exist all at once.
+            miss_embs = self.embed_all([unique_texts[i] for i in miss_idx])
+
+            unique_embs: List[Optional[List[float]]] = [None] * len(unique_texts)
+            for i, emb in zip(miss_idx, miss_embs):
+                unique_embs[i] = emb
+            for i, key in enumerate(keys):
+                if unique_embs[i] is None:
+                    unique_embs[i] = cache_vecs[cache_index[key]].tolist()
+
+            # ip space is only equivalent to cosine when every stored vector
+            # is unit length. Guard against regressions (or vectors cached
+            # before normalization landed) by renormalizing anything off.
+            vecs = np.asarray(unique_embs, dtype=np.float32)
+            norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+            if not np.allclose(norms, 1.0, atol=1e-3):
+                vecs = vecs / np.clip(norms, 1e-12, None)
+                unique_embs = vecs.tolist()
+
+            self._save_embed_cache(keys, unique_embs)
+            step = 4096
+            for s in range(0, len(docs), step):
+                e = s + step
+                self.collection.add(
+                    documents=docs[s:e],
+                    embeddings=[unique_embs[p] for p in dup_of[s:e]],
+                    metadatas=metas[s:e],
+                    ids=ids[s:e],
+                )
+
+        self._index_version += 1
+        self._save_manifest(fingerprints)
+
+    # ---------------------- Embedding cache ----------------------
+
+    def _embed_cache_key(self, text: str) -> str:
+        """Content hash scoped to the embedding model, so swapping models
+        invalidates every entry."""
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+        return f"{self.embed_model}::{digest}"
+
+    @property
+    def _embed_cache_dir(self) -> str:
+        return os.path.join(self.persist_dir, "embed_cache")
+
+    def _load_embed_cache(self):
+        """Return ({key: row}, vector matrix) from the last build, or an
+        empty index when there is no usable cache."""
+        try:
+            with open(
+                os.path.join(self._embed_cache_dir, "keys.json"),
+                "r",
+                encoding="utf-8",
+            ) as f:
+                keys = json.load(f)
+            vecs = np.load(os.path.join(self._embed_cache_dir, "vectors.npy"))
+            if len(keys) != vecs.shape[0]:
+                raise ValueError("key/vector count mismatch")
+        except (OSError, ValueError):
+            return {}, None
+        return {key: i for i, key in enumerate(keys)}, vecs
+
+    def _save_embed_cache(self, keys: List[str], embs: List[List[float]]) -> None:
+        """Persist this build's unique vectors as the new cache; entries no
+        longer in the corpus fall out, which bounds growth."""
+        try:
+            os.makedirs(self._embed_cache_dir, exist_ok=True)
+            np.save(
+                os.path.join(self._embed_cache_dir, "vectors.npy"),
+                np.asarray(embs, dtype=np.float32),
+            )
+            with open(
+                os.path.join(self._embed_cache_dir, "keys.json"),
+                "w",
+                encoding="utf-8",
+            ) as f:
+                json.dump(keys, f)
+        except OSError:
+            pass  # cache is an optimization; builds still work without it
+
+    # ---------------------- LLM response cache ----------------------
+    # RAG query traffic is heavily repetitive, and generation runs at a
+    # fixed low temperature, so (model, query, retrieved chunks) answers
+    # are safe to replay. The cache is an append-only JSONL so it survives
+    # process restarts.
+
+    @property
+    def _llm_cache_path(self) -> str:
+        return os.path.join(self.persist_dir, "llm_cache.jsonl")
+
+    def _llm_cache_key(
+        self, model_name: str, query: str, docs: List[Document]
+    ) -> str:
+        doc_key = ",".join(
+            sorted(
+                f"{d.metadata.get('source', 'unknown')}#{d.metadata.get('chunk', 0)}"
+                for d in docs
+            )
+        )
+        raw = f"{model_name}|{query}|{doc_key}"
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _llm_cache_get(self, key: str) -> Optional[str]:
+        if self._llm_cache is None:
+            cache: Dict[str, str] = {}
+            try:
+                with open(self._llm_cache_path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            rec = json.loads(line)
+                        except ValueError:
+                            continue
+                        if rec.get("key") and rec.get("answer"):
+                            cache[rec["key"]] = rec["answer"]
+            except OSError:
+                pass
+            self._llm_cache = cache
+        return self._llm_cache.get(key)
+
+    def _llm_cache_put(self, key: str, answer: str) -> None:
+        if self._llm_cache is None:
+            self._llm_cache = {}
+        if key in self._llm_cache:
+            return
+        self._llm_cache[key] = answer
+        try:
+            with open(self._llm_cache_path, "a", encoding="utf-8") as f:
+                f.write(
+                    json.dumps({"key": key, "answer": answer}, ensure_ascii=False)
+                    + "\n"
+                )
+        except OSError:
+            pass  # cache is an optimization; answers still flow without it
+
+    # ---------------------- Corpus manifest ----------------------
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.persist_dir, "manifest.json")
+
+    def _load_manifest(self) -> Dict[str, str]:
+        """{source name: content sha1} from the last completed build."""
+        try:
+            with open(self._manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, fingerprints: Dict[str, str]) -> None:
+        try:
+            with open(self._manifest_path, "w", encoding="utf-8") as f:
+                json.dump(fingerprints, f)
+        except OSError:
+            pass  # manifest is an optimization; builds still work without it
+
+    def _corpus_fingerprints(self) -> Dict[str, str]:
+        """Current {source name: content sha1} — reading is cheap next to
+        re-embedding, so this is the staleness check for rebuilds."""
+        return {
+            base: hashlib.sha1(text.encode("utf-8")).hexdigest()
+            for base, text in self._iter_source_texts()
+        }
 
     def rebuild_index(self) -> None:
         """
         Drop and rebuild the 'docs' collection using the same embedding model.
         Called when the user checks 'Rebuild index' in the UI.
         """
+        # Skip the whole drop/re-embed cycle when the corpus is untouched:
+        # the manifest holds per-source content hashes from the last build.
+        try:
+            unchanged = (
+                self.collection.count() > 0
+                and self._load_manifest() == self._corpus_fingerprints()
+            )
+        except Exception:
+            unchanged = False
+        if unchanged:
+            return
+
+        # Size the new graph from the outgoing collection before dropping it.
+        try:
+            prior_count = self.collection.count()
+        except Exception:
+            prior_count = 0
+
         try:
             self.client.delete_collection("docs")
         except Exception:
             # ok if it didn't exist
             pass
 
-        # Recreate using the same embedding function/model name
+        # Drop our handle on the outgoing collection so its segment caches
+        # can be reclaimed before the rebuild allocates the new graph.
+        del self.collection
+        gc.collect()
+
+        # Recreate with the same shared embedding function
         self.collection = self.client.get_or_create_collection(
             name="docs",
-            metadata={"hnsw:space": "cosine"},
-            embedding_function=embedding_functions.SentenceTransformerEmbeddingFunction(
-                model_name=self.embed_model
-            ),
+            metadata=configure_hnsw_params(prior_count),
+            embedding_function=self._embedding_function,
         )
         self._build_index()
 
     # ---------------------- Retrieval ----------------------
 
+    def _embed_query_uncached(self, text: str) -> Tuple[float, ...]:
+        """
+        Embed a single query string with the local SentenceTransformer.
+        Returns a tuple (hashable) so lru_cache can store it.
+        """
+        vec = self.embedder.encode(text)
+        return tuple(float(x) for x in vec)
+
+    def embed_cache_info(self):
+        """Expose lru_cache stats (hits/misses) for the observability UI."""
+        return self._embed_query.cache_info()
+
     def retrieve(self, query: str, k: int = 3) -> List[Document]:
         """
-        Retrieve top-k chunks from Chroma for a given query.
-        Also attaches similarity scores and ids into metadata for observability.
+        Retrieve top-k chunks from Chroma for a given query (cached per
+        index version). Also attaches similarity scores and ids into
+        metadata for observability.
+        """
+        return list(self._retrieve(query.strip(), k, self._index_version))
+
+    def _retrieve_uncached(
+        self, query: str, k: int, index_version: int
+    ) -> Tuple[Document, ...]:
+        """
+        Uncached retrieval; `index_version` only exists to scope cache
+        entries to the current index. Returns a tuple so cached results
+        are safe to share.
         """
+        # Embed here (cached) instead of letting Chroma re-run the model,
+        # so re-running the same query only pays for the ANN lookup.
+        emb = self._embed_query(query)
+
         # Some Chroma versions don't allow "ids" in include; ids come back by default.
         res = self.collection.query(
-            query_texts=[query],
+            query_embeddings=[list(emb)],
             n_results=k,
             include=["documents", "metadatas", "distances"],
         )
 
-        docs: List[Document] = []
-
         docs_raw = res.get("documents", [[]])[0]
         metas_raw = res.get("metadatas", [[]])[0]
         dists_raw = res.get("distances", [[]])[0] if "distances" in res else [None] * len(docs_raw)
         ids_raw = res.get("ids", [[]])[0] if "ids" in res else [None] * len(docs_raw)
 
-        for doc_text, meta, dist, doc_id in zip(docs_raw, metas_raw, dists_raw, ids_raw):
-            # Copy and enrich metadata so we don't mutate Chroma's internal objects
-            meta = dict(meta) if meta is not None else {}
-            if doc_id is not None:
-                meta.setdefault("id", doc_id)
-            if dist is not None:
-                # distance is smaller = more similar (cosine space)
-                meta.setdefault("distance", float(dist))
-            docs.append(Document(page_content=doc_text, metadata=meta))
+        # Dict-splat copies + enriches metadata at C speed (no per-key
+        # setdefault calls); distance is smaller = more similar (cosine).
+        return tuple(
+            Document(
+                page_content=doc_text,
+                metadata={
+                    **(meta or {}),
+                    "id": doc_id,
+                    "distance": float(dist) if dist is not None else None,
+                },
+            )
+            for doc_text, meta, dist, doc_id in zip(
+                docs_raw, metas_raw, dists_raw, ids_raw
+            )
+        )
+
+    def retrieve_many(self, queries: List[str], k: int = 3) -> List[List[Document]]:
+        """
+        Retrieve top-k chunks for many queries with one Chroma call.
+
+        The queries are embedded as a single batch (one tokenizer pad and
+        one model forward) and handed to collection.query together, so the
+        per-call embedding and HNSW setup cost is amortized across the
+        whole batch. Meant for evaluation loops that sweep a dataset.
+        """
+        if not queries:
+            return []
+
+        embs = self.embedder.encode(list(queries))
+        res = self.collection.query(
+            query_embeddings=[[float(x) for x in e] for e in embs],
+            n_results=k,
+            include=["documents", "metadatas", "distances"],
+        )
+
+        docs_all = res.get("documents") or [[] for _ in queries]
+        metas_all = res.get("metadatas") or [[] for _ in queries]
+        dists_all = res.get("distances") or [[None] * len(d) for d in docs_all]
+        ids_all = res.get("ids") or [[None] * len(d) for d in docs_all]
+
+        return [
+            [
+                Document(
+                    page_content=t,
+                    metadata={
+                        **(m or {}),
+                        "id": i,
+                        "distance": float(d) if d is not None else None,
+                    },
+                )
+                for t, m, d, i in zip(docs_raw, metas_raw, dists_raw, ids_raw)
+            ]
+            for docs_raw, metas_raw, dists_raw, ids_raw in zip(
+                docs_all, metas_all, dists_all, ids_all
+            )
+        ]
+
+    def retrieve_soa(self, query: str, k: int = 3) -> Retrieval:
+        """
+        Column-oriented variant of retrieve(): hand back Chroma's parallel
+        result lists as a Retrieval of columns instead of boxing each hit
+        into a Document with its own metadata dict. Missing distances come
+        back as NaN in a float32 array so callers can stay vectorized.
+        """
+        emb = self._embed_query(query)
+        res = self.collection.query(
+            query_embeddings=[list(emb)],
+            n_results=k,
+            include=["documents", "metadatas", "distances"],
+        )
+
+        texts = res.get("documents", [[]])[0]
+        metas = res.get("metadatas", [[]])[0]
+        n = len(texts)
+        ids = res.get("ids", [[]])[0] if "ids" in res else [None] * n
 
-        return docs
+        sources = [m.get("source", "unknown") if m else "unknown" for m in metas]
+        chunk_ids = np.fromiter(
+            (int(m.get("chunk", 0)) if m else 0 for m in metas),
+            dtype=np.int32,
+            count=n,
+        )
+        # Chroma hands distances back as one clean float list; asarray
+        # converts it in C without boxing a Python float per hit.
+        if res.get("distances"):
+            distances = np.asarray(res["distances"][0], dtype=np.float32)
+        else:
+            distances = np.full(n, np.nan, dtype=np.float32)
+        return Retrieval(
+            sources=sources,
+            chunks=chunk_ids,
+            distances=distances,
+            texts=list(texts),
+            ids=list(ids),
+        )
 
     # ---------------------- Prompt building ----------------------
 
+    # Static template text is interned once at class creation; per-request
+    # work is just the two substitutions. Context first, question last (see
+    # _build_messages for the prefix-caching rationale).
+    _USER_TEMPLATE = "Context items:\n\n{context}\n\nQuestion: {query}"
+
     def _build_context_and_sources(self, docs: List[Document]) -> Tuple[str, str]:
         """
         Build:
@@ -234,19 +885,26 @@ class RAGPipeline:
           - sources_block: human-readable citation list we append under the answer
         """
         numbered_lines = []
+        source_lines = []
+        # Stable order: the same set of retrieved chunks always renders to
+        # byte-identical context text regardless of retrieval/rerank order,
+        # which is what lets server-side prompt caching hit.
+        docs = sorted(
+            docs,
+            key=lambda d: (
+                d.metadata.get("source", "unknown"),
+                d.metadata.get("chunk", 0),
+            ),
+        )
+        # One pass: source/chunk are looked up once per doc and feed both
+        # the numbered context and the citation list.
         for idx, d in enumerate(docs, start=1):
             src = d.metadata.get("source", "unknown")
             chunk = d.metadata.get("chunk", 0)
             numbered_lines.append(f"[{idx}] ({src}#{chunk}) {d.page_content}")
+            source_lines.append(f"[{idx}] {src} (chunk {chunk})")
 
-        context_block = "\n\n".join(numbered_lines)
-
-        sources_block = "\n".join(
-            f"[{i}] {d.metadata.get('source', 'unknown')} (chunk {d.metadata.get('chunk', 0)})"
-            for i, d in enumerate(docs, start=1)
-        )
-
-        return context_block, sources_block
+        return "\n\n".join(numbered_lines), "\n".join(source_lines)
 
     def _build_messages(self, query: str, docs: List[Document]):
         """
@@ -255,10 +913,14 @@ class RAGPipeline:
         """
         context_block, sources_block = self._build_context_and_sources(docs)
 
-        user_content = (
-            f"Question: {query}\n\n"
-            f"Context items:\n\n"
-            f"{context_block}"
+        # Context first, question last: the query changes on every request,
+        # so putting it up front would invalidate any KV/prefix cache. With
+        # the (sorted, byte-stable) context as the prefix, OpenAI's automatic
+        # prompt caching — and vLLM-style prefix caches on self-hosted
+        # backends — can reuse the cached context across queries that
+        # retrieve the same popular chunks.
+        user_content = self._USER_TEMPLATE.format(
+            context=context_block, query=query
         )
 
         messages = [
@@ -291,51 +953,333 @@ class RAGPipeline:
                 input=messages,
                 temperature=0.2,
             )
+            return self._format_answer(resp, sources_block)
+        except Exception:
+            # fall back to baseline / other model
+            return None
+
+    @staticmethod
+    def _format_answer(resp, sources_block: str) -> Optional[str]:
+        """
+        Pull the text parts out of a Responses API result and append the
+        sources block. Returns None when the response carried no text.
+        """
+        # Grab the first text part of the first output
+        content_items = resp.output[0].content
+        text_parts: List[str] = []
+
+        for item in content_items:
+            # Newer SDK exposes `.text`; be defensive in case it's dict-like
+            text = getattr(item, "text", None)
+            if text is None and isinstance(item, dict):
+                text = item.get("text")
+            if text:
+                text_parts.append(text)
+
+        if not text_parts:
+            return None
 
-            # Grab the first text part of the first output
-            content_items = resp.output[0].content
-            text_parts: List[str] = []
+        answer = "\n".join(part.strip() for part in text_parts if part.strip())
 
-            for item in content_items:
-                # Newer SDK exposes `.text`; be defensive in case it's dict-like
-                text = getattr(item, "text", None)
-                if text is None and isinstance(item, dict):
-                    text = item.get("text")
-                if text:
-                    text_parts.append(text)
+        if sources_block:
+            answer += f"\n\nSources:\n{sources_block}"
 
-            if not text_parts:
-                return None
+        return answer.strip()
 
-            answer = "\n".join(part.strip() for part in text_parts if part.strip())
+    def _new_async_openai_client(self):
+        """Fresh AsyncOpenAI client, or None when the SDK/key is missing."""
+        if not self._openai_async_enabled:
+            return None
+        try:
+            return AsyncOpenAI(api_key=self._openai_key)
+        except Exception:
+            return None
 
-            if sources_block:
-                answer += f"\n\nSources:\n{sources_block}"
+    def _async_openai_client(self):
+        """
+        AsyncOpenAI client bound to the *running* event loop. The server's
+        long-lived loop reuses one cached client (keeping httpx's
+        connection pool warm); the weak keying lets clients die with their
+        loop. Throwaway asyncio.run() loops must not use this — they get a
+        fresh client that is closed before the loop is torn down (see
+        _agenerate_fresh_loop).
+        """
+        loop = asyncio.get_running_loop()
+        client = self._openai_async_clients.get(loop)
+        if client is None:
+            client = self._new_async_openai_client()
+            if client is not None:
+                self._openai_async_clients[loop] = client
+        return client
+
+    # How long the primary model gets before a hedge request to the base
+    # model is fired alongside it.
+    _HEDGE_DELAY_S = 0.3
+
+    async def _agenerate(
+        self,
+        query: str,
+        docs: List[Document],
+        primary_model: str,
+        client=None,
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Hedged generation over the async client: fire the primary model,
+        and if it hasn't answered within _HEDGE_DELAY_S (or fails outright)
+        race/try the base model. First usable answer wins and the loser is
+        cancelled — worst-case fallback latency becomes max(primary, base)
+        instead of their sum.
+
+        Returns (answer, model_name) where model_name is the racer that
+        actually produced the answer — the hedge winning means it can be
+        the base model, and the caller must not attribute (or cache) the
+        answer under the primary's name. None when every call failed.
+        """
+        if client is None:
+            client = self._async_openai_client()
+        if client is None:
+            return None
+
+        messages, sources_block = self._build_messages(query, docs)
 
-            return answer.strip()
+        async def call(model_name: str) -> Tuple[str, Optional[str]]:
+            try:
+                resp = await client.responses.create(
+                    model=model_name,
+                    input=messages,
+                    temperature=0.2,
+                )
+                return model_name, self._format_answer(resp, sources_block)
+            except Exception:
+                return model_name, None
 
-        except Exception:
-            # fall back to baseline / other model
+        tasks = {asyncio.create_task(call(primary_model))}
+        can_hedge = bool(self.base_model) and primary_model != self.base_model
+        base_started = False
+
+        if can_hedge:
+            _, pending = await asyncio.wait(tasks, timeout=self._HEDGE_DELAY_S)
+            if pending:
+                tasks.add(asyncio.create_task(call(self.base_model)))
+                base_started = True
+
+        while tasks:
+            done, tasks = await asyncio.wait(
+                tasks, return_when=asyncio.FIRST_COMPLETED
+            )
+            for t in done:
+                model_name, answer = t.result()
+                if answer is not None:
+                    for p in tasks:
+                        p.cancel()
+                    return answer, model_name
+            # Primary failed fast and the hedge never fired: try base now.
+            if not tasks and can_hedge and not base_started:
+                tasks = {asyncio.create_task(call(self.base_model))}
+                base_started = True
+
+        return None
+
+    async def _agenerate_fresh_loop(
+        self,
+        query: str,
+        docs: List[Document],
+        primary_model: str,
+    ) -> Optional[Tuple[str, str]]:
+        """
+        _agenerate for a throwaway asyncio.run() loop: the client must be
+        created on this loop and closed before the loop is torn down, or
+        its pooled connections would outlive (and break on) it.
+        """
+        client = self._new_async_openai_client()
+        if client is None:
             return None
+        try:
+            return await self._agenerate(query, docs, primary_model, client=client)
+        finally:
+            await client.close()
+
+    # English averages roughly 4 characters per token; used as the
+    # truncation fallback when tiktoken isn't installed.
+    _CHARS_PER_TOKEN = 4
+
+    def _truncate_to_tokens(self, text: str, max_tokens: int) -> str:
+        """
+        Cut `text` to at most `max_tokens` model tokens. Character slicing
+        is only a proxy — it either wastes budget (ASCII runs ~4 chars per
+        token) or overshoots it on non-ASCII text — so tokenize when
+        tiktoken is available and fall back to the heuristic otherwise.
+        """
+        enc = _token_encoding(self.base_model)
+        if enc is None:
+            return text[: max_tokens * self._CHARS_PER_TOKEN]
+        ids = enc.encode(text)
+        if len(ids) <= max_tokens:
+            return text
+        return enc.decode(ids[:max_tokens])
 
     def _baseline_answer(self, query: str, docs: List[Document]) -> str:
         """
         Very simple fallback "answer" if no LLM is available.
+        Shares _build_context_and_sources with the LLM path instead of
+        re-formatting the same per-doc lines a second time.
         """
-        context = "\n\n".join(
-            [f"[{i}] {d.page_content}" for i, d in enumerate(docs, start=1)]
-        )
-        sources_block = "\n".join(
-            f"[{i}] {d.metadata.get('source', 'unknown')} (chunk {d.metadata.get('chunk', 0)})"
-            for i, d in enumerate(docs, start=1)
-        )
-        return (
+        context, sources_block = self._build_context_and_sources(docs)
+        return _FallbackAnswer(
             "Using only the provided context, here is a concise answer.\n\n"
             f"Question: {query}\n\n"
-            f"Context (truncated):\n{context[:1200]}\n\n"
+            f"Context (truncated):\n{self._truncate_to_tokens(context, 300)}\n\n"
             f"Sources:\n{sources_block}"
         )
 
+    def _resolve_model(
+        self,
+        use_finetuned: Optional[bool],
+        force_model: Optional[str],
+    ) -> str:
+        """Pick the model to call, honoring force_model and the FT toggle."""
+        if force_model:
+            return force_model
+        use_ft = self.use_finetuned_by_default if use_finetuned is None else use_finetuned
+        if use_ft and self.ft_model:
+            return self.ft_model
+        return self.base_model
+
+    def generate_stream(
+        self,
+        query: str,
+        docs: List[Document],
+        use_finetuned: Optional[bool] = None,
+        force_model: Optional[str] = None,
+    ):
+        """
+        Yield the answer incrementally (token deltas) via the OpenAI
+        streaming API, then the sources block as a final piece.
+
+        Falls back to a single yield of the full generate() output when
+        streaming isn't available or errors out.
+        """
+        if not self._openai_client:
+            yield self._baseline_answer(query, docs)
+            return
+
+        model_name = self._resolve_model(use_finetuned, force_model)
+        messages, sources_block = self._build_messages(query, docs)
+
+        try:
+            stream = self._openai_client.responses.create(
+                model=model_name,
+                input=messages,
+                temperature=0.2,
+                stream=True,
+            )
+            streamed = False
+            for event in stream:
+                if getattr(event, "type", "") == "response.output_text.delta":
+                    delta = getattr(event, "delta", None)
+                    if delta:
+                        streamed = True
+                        yield delta
+            if not streamed:
+                # No deltas arrived; take the buffered path with fallbacks.
+                yield self.generate(query, docs, use_finetuned, force_model)
+                return
+            if sources_block:
+                yield f"\n\nSources:\n{sources_block}"
+        except Exception:
+            yield self.generate(query, docs, use_finetuned, force_model)
+
+    async def _agenerate_batch(
+        self,
+        queries: List[str],
+        docs_list: List[List[Document]],
+        use_finetuned: Optional[bool],
+        concurrency: int,
+    ) -> List[str]:
+        """
+        Answer many (query, docs) pairs with up to `concurrency` requests
+        in flight; the semaphore keeps the burst under API rate limits.
+        Each pair keeps the full fallback chain of generate().
+        """
+        sem = asyncio.Semaphore(concurrency)
+
+        async def one(query: str, docs: List[Document]) -> str:
+            async with sem:
+                return await self.agenerate(query, docs, use_finetuned)
+
+        return list(
+            await asyncio.gather(
+                *(one(q, d) for q, d in zip(queries, docs_list))
+            )
+        )
+
+    def generate_batch(
+        self,
+        queries: List[str],
+        docs_list: List[List[Document]],
+        use_finetuned: Optional[bool] = None,
+        concurrency: int = 10,
+    ) -> List[str]:
+        """
+        Synchronous facade for bulk generation: evaluation sweeps that
+        pair retrieve_many() with this overlap the ~1 s API round-trips
+        instead of paying them serially.
+        """
+        if not queries:
+            return []
+        return asyncio.run(
+            self._agenerate_batch(queries, docs_list, use_finetuned, concurrency)
+        )
+
+    async def agenerate_stream(
+        self,
+        query: str,
+        docs: List[Document],
+        use_finetuned: Optional[bool] = None,
+        force_model: Optional[str] = None,
+    ):
+        """
+        Async twin of generate_stream over AsyncOpenAI: deltas are awaited
+        natively, so SSE endpoints forward tokens without a thread hop per
+        token. Same fallback behavior — any problem degrades to one yield
+        of the buffered generate() output.
+        """
+        client = self._async_openai_client() if self._openai_async_enabled else None
+        if client is None:
+            yield await asyncio.to_thread(
+                self.generate, query, docs, use_finetuned, force_model
+            )
+            return
+
+        model_name = self._resolve_model(use_finetuned, force_model)
+        messages, sources_block = self._build_messages(query, docs)
+
+        try:
+            stream = await client.responses.create(
+                model=model_name,
+                input=messages,
+                temperature=0.2,
+                stream=True,
+            )
+            streamed = False
+            async for event in stream:
+                if getattr(event, "type", "") == "response.output_text.delta":
+                    delta = getattr(event, "delta", None)
+                    if delta:
+                        streamed = True
+                        yield delta
+            if not streamed:
+                yield await asyncio.to_thread(
+                    self.generate, query, docs, use_finetuned, force_model
+                )
+                return
+            if sources_block:
+                yield f"\n\nSources:\n{sources_block}"
+        except Exception:
+            yield await asyncio.to_thread(
+                self.generate, query, docs, use_finetuned, force_model
+            )
+
     def generate(
         self,
         query: str,
@@ -361,32 +1305,90 @@ class RAGPipeline:
             2. If primary was FT and fails, try base.
             3. If all LLM calls fail or client missing, return baseline answer.
         """
-        # Determine primary model
-        if force_model:
-            primary_model = force_model
-        else:
-            use_ft = self.use_finetuned_by_default if use_finetuned is None else use_finetuned
-            if use_ft and self.ft_model:
-                primary_model = self.ft_model
-            else:
-                primary_model = self.base_model
+        primary_model = self._resolve_model(use_finetuned, force_model)
+
+        # 0) Replay a previously generated answer for the same model, query
+        #    and retrieved chunks — a dict lookup instead of an API call.
+        cache_key = self._llm_cache_key(primary_model, query, docs)
+        cached = self._llm_cache_get(cache_key)
+        if cached is not None:
+            return cached
 
-        # 1) Try primary model (if we have an OpenAI client)
         answer: Optional[str] = None
-        if self._openai_client and primary_model:
-            answer = self._generate_with_openai(query, docs, primary_model)
+        answered_by: Optional[str] = None
 
-        # 2) If that failed AND it was the fine-tuned model, try falling back to base
-        if (
-            answer is None
-            and self._openai_client
-            and self.base_model
-            and primary_model != self.base_model
-        ):
-            answer = self._generate_with_openai(query, docs, self.base_model)
+        # 1) Hedged async path: primary + (after a short delay) base race,
+        #    so a slow or failing fine-tuned model costs max() not sum().
+        if self._openai_async_enabled and primary_model:
+            try:
+                hedged = asyncio.run(
+                    self._agenerate_fresh_loop(query, docs, primary_model)
+                )
+            except Exception:
+                hedged = None
+            if hedged is not None:
+                answer, answered_by = hedged
 
-        # 3) If everything failed, use baseline fallback
+        # 2) Serial sync chain when AsyncOpenAI isn't available.
+        elif self._openai_client and primary_model:
+            answer = self._generate_with_openai(query, docs, primary_model)
+            answered_by = primary_model
+            if (
+                answer is None
+                and self.base_model
+                and primary_model != self.base_model
+            ):
+                answer = self._generate_with_openai(query, docs, self.base_model)
+                answered_by = self.base_model
+
+        # 3) If everything failed, use baseline fallback (not cached: the
+        #    next attempt should get another shot at a real answer)
         if answer is None:
             return self._baseline_answer(query, docs)
 
+        # Cache under the model that actually answered: when the hedge (or
+        # the sync fallback) produced base-model output, storing it under
+        # the primary's key would permanently replay the wrong model's
+        # answer for this (query, chunks) pair.
+        if answered_by != primary_model:
+            cache_key = self._llm_cache_key(answered_by, query, docs)
+        self._llm_cache_put(cache_key, answer)
+        return answer
+
+    async def agenerate(
+        self,
+        query: str,
+        docs: List[Document],
+        use_finetuned: Optional[bool] = None,
+        force_model: Optional[str] = None,
+    ) -> str:
+        """
+        Async twin of generate() for callers already on the event loop:
+        same response cache, hedged primary/base race and baseline
+        fallback, but awaited over the shared AsyncOpenAI connection pool
+        so N in-flight answers overlap instead of serializing. Without the
+        async client it degrades to generate() on a worker thread.
+        """
+        primary_model = self._resolve_model(use_finetuned, force_model)
+
+        cache_key = self._llm_cache_key(primary_model, query, docs)
+        cached = self._llm_cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+        if not (self._openai_async_enabled and primary_model):
+            return await asyncio.to_thread(
+                self.generate, query, docs, use_finetuned, force_model
+            )
+
+        hedged = await self._agenerate(query, docs, primary_model)
+        if hedged is None:
+            return self._baseline_answer(query, docs)
+
+        # Same keying rule as generate(): a hedge win is a base-model
+        # answer and must be cached under the base model's key.
+        answer, answered_by = hedged
+        if answered_by != primary_model:
+            cache_key = self._llm_cache_key(answered_by, query, docs)
+        self._llm_cache_put(cache_key, answer)
         return answer
@@ -1,4 +1,4 @@
-﻿from pathlib import Path
+from pathlib import Path
 from dotenv import load_dotenv, find_dotenv
 import os, requests
 
@@ -17,8 +17,17 @@ if openai_key:
     try:
         from openai import OpenAI
         client = OpenAI(api_key=openai_key)
-        client.models.list()
-        print("✅ OpenAI key works! Found models.")
+        # One small GET instead of paginating the whole model catalog:
+        # auth is checked server-side before the lookup, so a 404 on the
+        # model id still proves the key is valid.
+        try:
+            client.models.retrieve("gpt-4o-mini")
+            print("✅ OpenAI key works!")
+        except Exception as e:
+            if getattr(e, "status_code", None) == 404:
+                print("✅ OpenAI key works! (model id not visible to this key)")
+            else:
+                raise
     except Exception as e:
         print("❌ OpenAI key error:", e)
 else:
@@ -27,14 +36,19 @@ else:
 # --- Test Hugging Face key ---
 if hf_key:
     try:
-        r = requests.get(
-            "https://huggingface.co/api/whoami-v2",
-            headers={"Authorization": f"Bearer {hf_key}"}
-        )
+        # HEAD is enough: the 200/401 status alone says whether the key is
+        # valid, without downloading the whoami JSON body. The session
+        # keeps the connection alive for any checks added later.
+        with requests.Session() as session:
+            r = session.head(
+                "https://huggingface.co/api/whoami-v2",
+                headers={"Authorization": f"Bearer {hf_key}"},
+                timeout=5,
+            )
         if r.status_code == 200:
-            print("✅ Hugging Face key works! User:", r.json().get("name"))
+            print("✅ Hugging Face key works!")
         else:
-            print("❌ Hugging Face key error:", r.status_code, r.text[:200])
+            print("❌ Hugging Face key error:", r.status_code)
     except Exception as e:
         print("❌ Hugging Face test failed:", e)
 else: